@@ -1,12 +1,17 @@
 #!/usr/bin/python3
 
 import asyncio
+import logging
 import os
 import re
+from typing import Any, Dict
 
-import aiohttp
+import orjson
 
-from github_stats import Stats
+from github_stats import Queries, Stats
+
+# Bumped whenever the cache format changes, so stale caches are discarded
+ETAG_CACHE_VERSION = 2
 
 
 ################################################################################
@@ -22,6 +27,33 @@ def generate_output_folder() -> None:
         os.mkdir("generated")
 
 
+def load_etag_cache(path: str) -> Dict[str, Any]:
+    """
+    Load cached REST summaries and their ETags saved by a previous run.
+    Caches in an older format, which could hold repository names, are dropped.
+    :param path: location of the JSON cache file
+    """
+    try:
+        with open(path, "rb") as f:
+            saved = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return dict()
+    if not isinstance(saved, dict) or saved.get("version") != ETAG_CACHE_VERSION:
+        return dict()
+    return saved.get("entries", dict())
+
+
+def save_etag_cache(cache: Dict[str, Any], path: str) -> None:
+    """
+    Save cached REST summaries and their ETags for the next run
+    :param cache: maps hashed REST paths to (ETag, summarized body)
+    :param path: location of the JSON cache file
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(orjson.dumps({"version": ETAG_CACHE_VERSION, "entries": cache}))
+
+
 ################################################################################
 # Individual Image Generation Functions
 ################################################################################
@@ -35,14 +67,18 @@ async def generate_overview(s: Stats) -> None:
     with open("templates/overview.svg", "r") as f:
         output = f.read()
 
-    output = re.sub("{{ name }}", await s.name, output)
-    output = re.sub("{{ stars }}", f"{await s.stargazers:,}", output)
-    output = re.sub("{{ forks }}", f"{await s.forks:,}", output)
-    output = re.sub("{{ contributions }}", f"{await s.total_contributions:,}", output)
-    changed = (await s.lines_changed)[0] + (await s.lines_changed)[1]
+    await s.get_stats()
+    output = re.sub("{{ name }}", s.name, output)
+    output = re.sub("{{ stars }}", f"{s.stargazers:,}", output)
+    output = re.sub("{{ forks }}", f"{s.forks:,}", output)
+    contributions, lines_changed, views = await asyncio.gather(
+        s.total_contributions, s.lines_changed, s.views
+    )
+    output = re.sub("{{ contributions }}", f"{contributions:,}", output)
+    changed = lines_changed[0] + lines_changed[1]
     output = re.sub("{{ lines_changed }}", f"{changed:,}", output)
-    output = re.sub("{{ views }}", f"{await s.views:,}", output)
-    output = re.sub("{{ repos }}", f"{len(await s.repos):,}", output)
+    output = re.sub("{{ views }}", f"{views:,}", output)
+    output = re.sub("{{ repos }}", f"{len(s.repos):,}", output)
 
     generate_output_folder()
     with open("generated/overview.svg", "w") as f:
@@ -59,8 +95,9 @@ async def generate_languages(s: Stats) -> None:
 
     progress = ""
     lang_list = ""
+    await s.get_stats()
     sorted_languages = sorted(
-        (await s.languages).items(), reverse=True, key=lambda t: t[1].get("size")
+        s.languages.items(), reverse=True, key=lambda t: t[1].get("size")
     )
     delay_between = 150
     for i, (lang, data) in enumerate(sorted_languages):
@@ -120,18 +157,23 @@ async def main() -> None:
         not not raw_ignore_forked_repos
         and raw_ignore_forked_repos.strip().lower() != "false"
     )
-    async with aiohttp.ClientSession() as session:
+    etag_cache_path = os.getenv("ETAG_CACHE", ".cache/etags.json")
+    etag_cache = load_etag_cache(etag_cache_path)
+    async with Queries.create_client() as client:
         s = Stats(
             user,
             access_token,
-            session,
+            client,
             exclude_repos=excluded_repos,
             exclude_langs=excluded_langs,
             ignore_forked_repos=ignore_forked_repos,
+            etag_cache=etag_cache,
         )
         await asyncio.gather(generate_languages(s), generate_overview(s))
+    save_etag_cache(etag_cache, etag_cache_path)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
     asyncio.run(main())
     
@@ -1,10 +1,54 @@
 #!/usr/bin/python3
 
 import asyncio
+import contextlib
+import functools
+import hashlib
+import logging
 import os
-from typing import Dict, List, Optional, Set, Tuple, Any, cast
+import time
+from urllib.parse import urlencode
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+import httpx
+import orjson
+
+log = logging.getLogger(__name__)
+
+
+class GithubQueryError(Exception):
+    """
+    Raised when a request to the GitHub API fails or returns no usable data.
+    Carries the response status and headers, when there was a response, so
+    callers can honor rate limits when retrying.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        status: Optional[int] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        rate_limited: bool = False,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.headers: Mapping[str, str] = {} if headers is None else headers
+        self.rate_limited = rate_limited
 
-import aiohttp
 
 ###############################################################################
 # Main Classes
@@ -17,87 +61,302 @@ class Queries(object):
     API. Also includes functions to dynamically generate GraphQL queries.
     """
 
+    # Upper bound on REST attempts while waiting on a 202 or a rate limit
+    max_rest_attempts = 6
+    # Upper bound on attempts for a GraphQL query that fails or is rate limited
+    max_graphql_attempts = 6
+    # Repositories per lines-changed query and commits per history page, kept
+    # small because diff stats are expensive for GitHub to compute
+    history_batch_size = 10
+    history_page_size = 50
+
     def __init__(
         self,
         username: str,
         access_token: str,
-        session: aiohttp.ClientSession,
+        client: httpx.AsyncClient,
         max_connections: int = 10,
+        etag_cache: Optional[MutableMapping[str, Any]] = None,
     ):
         self.username = username
         self.access_token = access_token
-        self.session = session
-        self.semaphore = asyncio.Semaphore(max_connections)
+        self.client = client
+        # Built once rather than on every request
+        self._gql_headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+        }
+        self._rest_headers = {
+            "Authorization": f"token {access_token}",
+        }
+        # Maps hashed REST paths to (ETag, summarized body) for conditional
+        # requests. Hashing keeps private repository names out of the cache.
+        self.etag_cache = etag_cache
+
+        # Admission control with a ceiling that adapts to GitHub's rate limit
+        # headers, which a fixed Semaphore cannot do
+        self._max_connections = max_connections
+        self._limit = max_connections
+        self._in_flight = 0
+        self._admission = asyncio.Condition()
+
+    @staticmethod
+    def create_client(max_connections: int = 10) -> httpx.AsyncClient:
+        """
+        Create an HTTP/2 client that multiplexes requests over a small pool of
+        kept-alive connections to the API
+        :param max_connections: maximum number of simultaneous connections
+        """
+        return httpx.AsyncClient(
+            http2=True,
+            # Large GraphQL pages can take well over httpx's 5 second default
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30,
+            ),
+        )
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """
+        Wait until fewer than the current limit of requests are in flight, and
+        hold a slot for the duration of the context
+        """
+        async with self._admission:
+            await self._admission.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._admission:
+                self._in_flight -= 1
+                self._admission.notify(1)
+
+    async def set_max(self, limit: int) -> None:
+        """
+        Change the number of requests allowed in flight at once
+        :param limit: new ceiling, clamped to [1, max_connections]
+        """
+        limit = max(1, min(limit, self._max_connections))
+        async with self._admission:
+            grew = limit > self._limit
+            self._limit = limit
+            if grew:
+                self._admission.notify_all()
+
+    async def update_limit(
+        self, status: int, headers: Mapping[str, str], body: bytes = b""
+    ) -> None:
+        """
+        Adjust the concurrency ceiling after a response: halve it when rate
+        limited, drop to one request at a time when under 10% of the rate limit
+        budget remains, and otherwise grow it back one slot at a time
+        """
+        remaining = headers.get("X-RateLimit-Remaining", "")
+        total = headers.get("X-RateLimit-Limit", "")
+        if self.is_rate_limited(status, headers, body):
+            limit = self._limit // 2
+        elif (
+            remaining.isdigit()
+            and total.isdigit()
+            and int(remaining) < int(total) // 10
+        ):
+            limit = 1
+        else:
+            limit = self._limit + 1
+        await self.set_max(limit)
 
     async def query(self, generated_query: str) -> Dict:
         """
         Make a request to the GraphQL API using the authentication token from
         the environment
+        :raises GithubQueryError: if the request fails or returns no data
         """
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-        }
         try:
-            async with self.semaphore:
-                async with self.session.post(
+            async with self.admit():
+                response = await self.client.post(
                     "https://api.github.com/graphql",
-                    headers=headers,
-                    json={"query": generated_query},
-                ) as response:
-                    result = await response.json()
-                    if result is not None:
-                        return result
+                    headers=self._gql_headers,
+                    content=orjson.dumps({"query": generated_query}),
+                )
+                await self.update_limit(
+                    response.status_code, response.headers, response.content
+                )
+            result = orjson.loads(response.content)
         except Exception as e:
-            print(f"aiohttp failed for GraphQL query: {e}")
-        
-        return dict()
-
-    async def query_rest(self, path: str, params: Optional[Dict] = None) -> Any:
-        """
-        Make a request to the REST API
-        """
-        # Reduced retries to prevent infinite hangs
-        for _ in range(67):
-            headers = {
-                "Authorization": f"token {self.access_token}",
-            }
-            if params is None:
-                params = dict()
-            if path.startswith("/"):
-                path = path[1:]
-            
+            raise GithubQueryError(f"httpx failed for GraphQL query: {e}") from e
+
+        if not isinstance(result, dict) or result.get("data") is None:
+            message = result.get("message") if isinstance(result, dict) else None
+            raise GithubQueryError(
+                f"GraphQL query returned {response.status_code} without data: "
+                f"{message}",
+                status=response.status_code,
+                headers=response.headers,
+                rate_limited=self.is_rate_limited(
+                    response.status_code, response.headers, response.content
+                ),
+            )
+        return result
+
+    async def query_rest(
+        self,
+        path: str,
+        params: Optional[Dict] = None,
+        summarize: Optional[Callable[[Any], Any]] = None,
+    ) -> Any:
+        """
+        Make a request to the REST API, backing off exponentially while GitHub
+        is still computing statistics (202) or rate limiting us. Client errors
+        that cannot succeed on retry, such as a 404, return an empty dict.
+        :param summarize: reduces the parsed body to what the caller needs;
+        only the summary is returned and stored in the ETag cache. Cache
+        entries are keyed by its qualified name, so distinct summaries of the
+        same path need distinctly named functions rather than lambdas.
+        :raises GithubQueryError: if the request fails or retries run out
+        """
+        headers = self._rest_headers
+        if params is None:
+            params = dict()
+        if path.startswith("/"):
+            path = path[1:]
+
+        # Revalidate a previously seen response instead of downloading it again;
+        # a 304 does not count against the rate limit. The key includes the
+        # summarizer, so callers summarizing the same path differently never
+        # receive each other's cached values.
+        summary_tag = "" if summarize is None else summarize.__qualname__
+        cache_key = hashlib.sha256(
+            "\0".join(
+                [path + ("?" + urlencode(params) if params else ""), summary_tag]
+            ).encode()
+        ).hexdigest()
+        cached = None if self.etag_cache is None else self.etag_cache.get(cache_key)
+        if cached is not None:
+            headers = {**headers, "If-None-Match": cached[0]}
+
+        for attempt in range(self.max_rest_attempts):
             try:
-                async with self.semaphore:
-                    async with self.session.get(
+                async with self.admit():
+                    response = await self.client.get(
                         f"https://api.github.com/{path}",
                         headers=headers,
-                        params=tuple(params.items()),
-                    ) as response:
-                        
-                        if response.status == 202:
-                            print(f"Path {path} returned 202 (Processing). Retrying...")
-                            await asyncio.sleep(2)
-                            continue
-                        
-                        result = await response.json()
-                        if result is not None:
-                            return result
-                            
+                        params=params,
+                    )
+                    await self.update_limit(
+                        response.status_code, response.headers, response.content
+                    )
+
+                status = response.status_code
+                min_delay = 0.0
+                if status == 304 and cached is not None:
+                    return cached[1]
+                elif status == 202:
+                    log.debug("Path %s returned 202 (Processing). Retrying...", path)
+                elif self.is_rate_limited(status, response.headers, response.content):
+                    log.warning("Path %s was rate limited. Retrying...", path)
+                    # GitHub asks for at least a minute between retries when a
+                    # secondary rate limit gives no explicit wait
+                    min_delay = 60.0
+                elif status >= 500:
+                    log.warning("Path %s returned %d. Retrying...", path, status)
+                elif status >= 400:
+                    # Other client errors will not succeed on retry
+                    log.warning("Path %s returned %d. Skipping.", path, status)
+                    return dict()
+                else:
+                    result = orjson.loads(response.content)
+                    if result is not None:
+                        if summarize is not None:
+                            result = summarize(result)
+                        etag = response.headers.get("ETag")
+                        if self.etag_cache is not None and etag is not None:
+                            self.etag_cache[cache_key] = (etag, result)
+                        return result
+
             except Exception as e:
-                print(f"aiohttp failed for rest query {path}: {e}")
-                return dict()
+                raise GithubQueryError(
+                    f"httpx failed for rest query {path}: {e}"
+                ) from e
+
+            # Sleep after releasing the slot so waiting does not hold it
+            if attempt + 1 < self.max_rest_attempts:
+                await asyncio.sleep(
+                    self.retry_delay(response.headers, attempt, min_delay)
+                )
 
-        print(f"There were too many 202s. Data for {path} will be incomplete.")
-        return dict()
+        raise GithubQueryError(f"There were too many retries for {path}")
 
     @staticmethod
-    def repos_overview(
-        contrib_cursor: Optional[str] = None, owned_cursor: Optional[str] = None
-    ) -> str:
+    def is_rate_limited(
+        status: int, headers: Mapping[str, str], body: bytes = b""
+    ) -> bool:
+        """
+        :return: True if the response signals a primary or secondary rate limit
+        """
+        if status == 429:
+            return True
+        return status == 403 and (
+            "Retry-After" in headers
+            or headers.get("X-RateLimit-Remaining") == "0"
+            # Secondary rate limits may come without either header
+            or b"secondary rate limit" in body.lower()
+        )
+
+    @staticmethod
+    def retry_delay(
+        headers: Mapping[str, str], attempt: int, min_delay: float = 0.0
+    ) -> float:
+        """
+        :return: seconds to wait before retrying, honoring the rate limit
+        headers when present and falling back to capped exponential backoff of
+        at least min_delay
+        """
+        retry_after = headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+        reset = headers.get("X-RateLimit-Reset", "")
+        if headers.get("X-RateLimit-Remaining") == "0" and reset.isdigit():
+            return max(0.0, float(reset) - time.time())
+        return max(min_delay, float(min(2 ** attempt, 30)))
+
+    # Fields fetched for every repository, shared by both repository queries
+    REPO_FRAGMENT = """
+fragment RepoFields on Repository {
+  nameWithOwner
+  stargazers {
+    totalCount
+  }
+  forkCount
+  languages(first: 10, orderBy: {field: SIZE, direction: DESC}) {
+    edges {
+      size
+      node {
+        name
+        color
+      }
+    }
+  }
+}
+"""
+
+    @classmethod
+    def repos_owned(cls, owned_cursor: Optional[str] = None) -> str:
+        # Fetch the contribution years with the first page, saving a round trip
+        # before querying contributions
+        years = (
+            "contributionsCollection { contributionYears },"
+            if owned_cursor is None
+            else ""
+        )
         return f"""{{
   viewer {{
+    id,
     login,
     name,
+    {years}
     repositories(
         first: 100,
         orderBy: {{
@@ -112,22 +371,19 @@ class Queries(object):
         endCursor
       }}
       nodes {{
-        nameWithOwner
-        stargazers {{
-          totalCount
-        }}
-        forkCount
-        languages(first: 10, orderBy: {{field: SIZE, direction: DESC}}) {{
-          edges {{
-            size
-            node {{
-              name
-              color
-            }}
-          }}
-        }}
+        ...RepoFields
       }}
     }}
+  }}
+}}
+{cls.REPO_FRAGMENT}"""
+
+    @classmethod
+    def repos_contributed(cls, contrib_cursor: Optional[str] = None) -> str:
+        return f"""{{
+  viewer {{
+    login,
+    name,
     repositoriesContributedTo(
         first: 100,
         includeUserRepositories: false,
@@ -148,44 +404,61 @@ class Queries(object):
         endCursor
       }}
       nodes {{
-        nameWithOwner
-        stargazers {{
-          totalCount
-        }}
-        forkCount
-        languages(first: 10, orderBy: {{field: SIZE, direction: DESC}}) {{
-          edges {{
-            size
-            node {{
-              name
-              color
+        ...RepoFields
+      }}
+    }}
+  }}
+}}
+{cls.REPO_FRAGMENT}"""
+
+    @classmethod
+    def lines_changed_batch(
+        cls, author_id: str, repos: List[Tuple[str, Optional[str]]]
+    ) -> str:
+        """
+        :param author_id: GraphQL node ID of the commit author
+        :param repos: (nameWithOwner, history cursor) pairs, aliased in order as
+        repo0, repo1, ...
+        """
+        by_repos = []
+        for i, (repo, cursor) in enumerate(repos):
+            owner, name = repo.split("/", 1)
+            by_repos.append(f"""
+  repo{i}: repository(owner: "{owner}", name: "{name}") {{
+    defaultBranchRef {{
+      target {{
+        ... on Commit {{
+          history(
+              first: {cls.history_page_size},
+              author: {{id: "{author_id}"}},
+              after: {"null" if cursor is None else '"'+ cursor +'"'}
+          ) {{
+            pageInfo {{
+              hasNextPage
+              endCursor
+            }}
+            nodes {{
+              additions
+              deletions
+              parents {{
+                totalCount
+              }}
             }}
           }}
         }}
       }}
     }}
   }}
-}}
-"""
-
-    @staticmethod
-    def contrib_years() -> str:
-        return """
-query {
-  viewer {
-    contributionsCollection {
-      contributionYears
-    }
-  }
-}
-"""
+""")
+        return "{" + "".join(by_repos) + "}"
 
     @staticmethod
-    def contribs_by_year(year: str) -> str:
+    @functools.lru_cache(maxsize=512)
+    def contribs_by_year(year: int) -> str:
         return f"""
     year{year}: contributionsCollection(
         from: "{year}-01-01T00:00:00Z",
-        to: "{int(year) + 1}-01-01T00:00:00Z"
+        to: "{year + 1}-01-01T00:00:00Z"
     ) {{
       contributionCalendar {{
         totalContributions
@@ -194,7 +467,13 @@ query {
 """
 
     @classmethod
-    def all_contribs(cls, years: List[str]) -> str:
+    def all_contribs(cls, years: Iterable[int]) -> str:
+        # The cache needs a hashable key, so pass the years as a tuple
+        return cls._all_contribs(tuple(years))
+
+    @classmethod
+    @functools.lru_cache(maxsize=512)
+    def _all_contribs(cls, years: Tuple[int, ...]) -> str:
         by_years = "\n".join(map(cls.contribs_by_year, years))
         return f"""
 query {{
@@ -214,25 +493,35 @@ class Stats(object):
         self,
         username: str,
         access_token: str,
-        session: aiohttp.ClientSession,
+        client: httpx.AsyncClient,
         exclude_repos: Optional[Set] = None,
         exclude_langs: Optional[Set] = None,
         ignore_forked_repos: bool = False,
+        etag_cache: Optional[MutableMapping[str, Any]] = None,
     ):
         self.username = username
         self._ignore_forked_repos = ignore_forked_repos
         self._exclude_repos = set() if exclude_repos is None else exclude_repos
         self._exclude_langs = set() if exclude_langs is None else exclude_langs
-        self.queries = Queries(username, access_token, session)
+        self._exclude_langs_lower = {x.lower() for x in self._exclude_langs}
+        # Whether each language name seen so far is excluded. Only a handful of
+        # names recur across repositories, so this saves lowercasing each edge.
+        self._lang_excluded: Dict[str, bool] = dict()
+        self.queries = Queries(
+            username, access_token, client, etag_cache=etag_cache
+        )
         
         # Lock to prevent race conditions during parallel fetching
         self._stats_lock = asyncio.Lock()
 
         self._name: Optional[str] = None
+        self._user_id: Optional[str] = None
+        self._years: Optional[List[int]] = None
         self._stargazers: Optional[int] = None
         self._forks: Optional[int] = None
         self._total_contributions: Optional[int] = None
         self._languages: Optional[Dict[str, Any]] = None
+        self._languages_proportional: Optional[Dict[str, float]] = None
         self._repos: Optional[Set[str]] = None
         self._lines_changed: Optional[Tuple[int, int]] = None
         self._views: Optional[int] = None
@@ -241,20 +530,24 @@ class Stats(object):
         """
         :return: summary of all available statistics
         """
-        languages = await self.languages_proportional
+        await self.get_stats()
+        languages = self.languages_proportional
         formatted_languages = "\n  - ".join(
             [f"{k}: {v:0.4f}%" for k, v in languages.items()]
         )
-        lines_changed = await self.lines_changed
-        return f"""Name: {await self.name}
-Stargazers: {await self.stargazers:,}
-Forks: {await self.forks:,}
-All-time contributions: {await self.total_contributions:,}
-Repositories with contributions: {len(await self.repos)}
+        # These only depend on get_stats, so fetch them concurrently
+        total_contributions, lines_changed, views = await asyncio.gather(
+            self.total_contributions, self.lines_changed, self.views
+        )
+        return f"""Name: {self.name}
+Stargazers: {self.stargazers:,}
+Forks: {self.forks:,}
+All-time contributions: {total_contributions:,}
+Repositories with contributions: {len(self.repos)}
 Lines of code added: {lines_changed[0]:,}
 Lines of code deleted: {lines_changed[1]:,}
 Lines of code changed: {lines_changed[0] + lines_changed[1]:,}
-Project page views: {await self.views:,}
+Project page views: {views:,}
 Languages:
   - {formatted_languages}"""
 
@@ -277,125 +570,210 @@ Languages:
             self._languages = dict()
             self._repos = set()
 
-            exclude_langs_lower = {x.lower() for x in self._exclude_langs}
-
-            next_owned = None
-            next_contrib = None
-            while True:
-                raw_results = await self.queries.query(
-                    Queries.repos_overview(
-                        owned_cursor=next_owned, contrib_cursor=next_contrib
+            # Owned and contributed repositories have independent cursors, so
+            # page through both connections concurrently
+            paginators = [self._paginate(Queries.repos_owned, "repositories")]
+            if not self._ignore_forked_repos:
+                paginators.append(
+                    self._paginate(
+                        Queries.repos_contributed, "repositoriesContributedTo"
                     )
                 )
-                raw_results = raw_results if raw_results is not None else {}
-
-                self._name = raw_results.get("data", {}).get("viewer", {}).get("name", None)
-                if self._name is None:
-                    self._name = (
-                        raw_results.get("data", {})
-                        .get("viewer", {})
-                        .get("login", "No Name")
-                    )
+            viewer, *_ = await asyncio.gather(*paginators)
 
-                contrib_repos = (
-                    raw_results.get("data", {})
-                    .get("viewer", {})
-                    .get("repositoriesContributedTo", {})
-                )
-                owned_repos = (
-                    raw_results.get("data", {}).get("viewer", {}).get("repositories", {})
+            # Convert sizes to percentages in one pass with a single division
+            langs_total = sum(v.get("size", 0) for v in self._languages.values())
+            scale = 100 / langs_total if langs_total > 0 else 0
+            self._languages_proportional = dict()
+            for k, v in self._languages.items():
+                v["prop"] = v.get("size", 0) * scale
+                self._languages_proportional[k] = v["prop"]
+
+            # Set the name last, since it marks the statistics as loaded
+            name = viewer.get("name", None)
+            if name is None:
+                name = viewer.get("login", "No Name")
+            self._user_id = viewer.get("id")
+            self._years = (viewer.get("contributionsCollection") or {}).get(
+                "contributionYears", []
+            )
+            self._name = name
+
+    async def _paginate(
+        self, generate_query: Callable[[Optional[str]], str], connection: str
+    ) -> Dict:
+        """
+        Walk every page of one of the viewer's repository connections, adding
+        each page of repositories to the running statistics
+        :param generate_query: builds the query for a given page cursor
+        :param connection: name of the repository connection on the viewer
+        :return: viewer object of the first page
+        """
+        first_viewer = None
+        cursor = None
+        while True:
+            raw_results = await self._query_with_retry(generate_query(cursor))
+            viewer = (raw_results.get("data") or {}).get("viewer") or {}
+            if first_viewer is None:
+                first_viewer = viewer
+
+            repos = viewer.get(connection) or {}
+            self._add_repos(repos.get("nodes", []))
+
+            if repos.get("pageInfo", {}).get("hasNextPage", False):
+                cursor = repos.get("pageInfo", {}).get("endCursor", cursor)
+            else:
+                break
+
+        return first_viewer
+
+    async def _query_with_retry(self, generated_query: str) -> Dict:
+        """
+        Make a GraphQL query, retrying it with backoff if it fails, so that one
+        bad response does not silently truncate the statistics
+        :raises GithubQueryError: if every attempt fails
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self.queries.query(generated_query)
+            except GithubQueryError as e:
+                attempt += 1
+                if attempt >= self.queries.max_graphql_attempts:
+                    raise
+                log.warning("%s. Retrying...", e)
+                # Wait at least a minute on a rate limit without explicit timing
+                min_delay = 60.0 if e.rate_limited else 0.0
+                await asyncio.sleep(
+                    Queries.retry_delay(e.headers, attempt - 1, min_delay)
                 )
 
-                repos = owned_repos.get("nodes", [])
-                if not self._ignore_forked_repos:
-                    repos += contrib_repos.get("nodes", [])
-
-                for repo in repos:
-                    if repo is None:
-                        continue
-                    name = repo.get("nameWithOwner")
-                    if name in self._repos or name in self._exclude_repos:
-                        continue
-                    self._repos.add(name)
-                    self._stargazers += repo.get("stargazers").get("totalCount", 0)
-                    self._forks += repo.get("forkCount", 0)
-
-                    for lang in repo.get("languages", {}).get("edges", []):
-                        name = lang.get("node", {}).get("name", "Other")
-                        languages = await self.languages
-                        if name.lower() in exclude_langs_lower:
-                            continue
-                        if name in languages:
-                            languages[name]["size"] += lang.get("size", 0)
-                            languages[name]["occurrences"] += 1
-                        else:
-                            languages[name] = {
-                                "size": lang.get("size", 0),
-                                "occurrences": 1,
-                                "color": lang.get("node", {}).get("color"),
-                            }
-
-                if owned_repos.get("pageInfo", {}).get(
-                    "hasNextPage", False
-                ) or contrib_repos.get("pageInfo", {}).get("hasNextPage", False):
-                    next_owned = owned_repos.get("pageInfo", {}).get(
-                        "endCursor", next_owned
-                    )
-                    next_contrib = contrib_repos.get("pageInfo", {}).get(
-                        "endCursor", next_contrib
-                    )
+    def _add_repos(self, repos: List[Dict]) -> None:
+        """
+        Accumulate one page of repositories into the statistics. This never
+        awaits, so concurrent paginators cannot interleave their updates.
+        :param repos: repository nodes returned by the GraphQL API
+        """
+        assert self._repos is not None and self._languages is not None
+
+        # Bind hot-loop state to locals to avoid repeated attribute lookups
+        languages = self._languages
+        repos_seen = self._repos
+        exclude_repos = self._exclude_repos
+        exclude_langs_lower = self._exclude_langs_lower
+        lang_excluded = self._lang_excluded
+
+        stargazers = 0
+        forks = 0
+        for repo in repos:
+            if repo is None:
+                continue
+            # Skip duplicates and exclusions before touching any other fields
+            name = repo.get("nameWithOwner")
+            if name in repos_seen or name in exclude_repos:
+                continue
+            repos_seen.add(name)
+            stargazers += (repo.get("stargazers") or {}).get("totalCount", 0)
+            forks += repo.get("forkCount", 0)
+
+            for lang in repo.get("languages", {}).get("edges", []):
+                name = lang.get("node", {}).get("name", "Other")
+                excluded = lang_excluded.get(name)
+                if excluded is None:
+                    excluded = name.lower() in exclude_langs_lower
+                    lang_excluded[name] = excluded
+                if excluded:
+                    continue
+                if name in languages:
+                    languages[name]["size"] += lang.get("size", 0)
+                    languages[name]["occurrences"] += 1
                 else:
-                    break
+                    languages[name] = {
+                        "size": lang.get("size", 0),
+                        "occurrences": 1,
+                        "color": lang.get("node", {}).get("color"),
+                    }
 
-            langs_total = sum([v.get("size", 0) for v in self._languages.values()])
-            for k, v in self._languages.items():
-                v["prop"] = 100 * (v.get("size", 0) / langs_total) if langs_total > 0 else 0
+        self._stargazers = cast(int, self._stargazers) + stargazers
+        self._forks = cast(int, self._forks) + forks
+
+    @staticmethod
+    async def _bounded_map(
+        coro_fn: Callable[[Any], Awaitable[Any]], items: List, workers: int = 16
+    ) -> List:
+        """
+        Apply an async function to every item using a fixed pool of workers
+        fed from a queue, rather than creating one task per item up front
+        :param coro_fn: async function to apply to each item
+        :param items: inputs to coro_fn
+        :param workers: maximum number of calls in flight at once
+        :return: results in the same order as items
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for i, item in enumerate(items):
+            queue.put_nowait((i, item))
+        results: List[Any] = [None] * len(items)
+
+        async def worker() -> None:
+            while not queue.empty():
+                i, item = queue.get_nowait()
+                results[i] = await coro_fn(item)
+
+        tasks = [
+            asyncio.ensure_future(worker())
+            for _ in range(min(workers, len(items)))
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # gather does not cancel the other workers when one fails
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return results
+
+    def _check_loaded(self) -> None:
+        """
+        Raise if get_stats has not finished, since the properties it populates
+        are read synchronously
+        """
+        if self._name is None:
+            raise RuntimeError("Statistics are not loaded; await get_stats() first")
 
     @property
-    async def name(self) -> str:
-        if self._name is not None:
-            return self._name
-        await self.get_stats()
+    def name(self) -> str:
+        self._check_loaded()
         assert self._name is not None
         return self._name
 
     @property
-    async def stargazers(self) -> int:
-        if self._stargazers is not None:
-            return self._stargazers
-        await self.get_stats()
+    def stargazers(self) -> int:
+        self._check_loaded()
         assert self._stargazers is not None
         return self._stargazers
 
     @property
-    async def forks(self) -> int:
-        if self._forks is not None:
-            return self._forks
-        await self.get_stats()
+    def forks(self) -> int:
+        self._check_loaded()
         assert self._forks is not None
         return self._forks
 
     @property
-    async def languages(self) -> Dict:
-        if self._languages is not None:
-            return self._languages
-        await self.get_stats()
+    def languages(self) -> Dict:
+        self._check_loaded()
         assert self._languages is not None
         return self._languages
 
     @property
-    async def languages_proportional(self) -> Dict:
-        if self._languages is None:
-            await self.get_stats()
-            assert self._languages is not None
-
-        return {k: v.get("prop", 0) for (k, v) in self._languages.items()}
+    def languages_proportional(self) -> Dict:
+        self._check_loaded()
+        assert self._languages_proportional is not None
+        return self._languages_proportional
 
     @property
-    async def repos(self) -> Set[str]:
-        if self._repos is not None:
-            return self._repos
-        await self.get_stats()
+    def repos(self) -> Set[str]:
+        self._check_loaded()
         assert self._repos is not None
         return self._repos
 
@@ -404,25 +782,28 @@ Languages:
         if self._total_contributions is not None:
             return self._total_contributions
 
-        self._total_contributions = 0
-        years = (
-            (await self.queries.query(Queries.contrib_years()))
-            .get("data", {})
-            .get("viewer", {})
-            .get("contributionsCollection", {})
-            .get("contributionYears", [])
-        )
-        
+        await self.get_stats()
+        assert self._years is not None
+        years = self._years
+        if not years:
+            # An empty years list would build an invalid query
+            self._total_contributions = 0
+            return 0
+
         # FIX: Correctly access the data dictionary
-        response = await self.queries.query(Queries.all_contribs(years))
-        viewer_data = response.get("data", {}).get("viewer", {})
-        
+        response = await self._query_with_retry(Queries.all_contribs(years))
+        viewer = (response.get("data") or {}).get("viewer") or {}
+
         # iterate over keys like year2020, year2021...
-        for year_data in viewer_data.values():
-            self._total_contributions += year_data.get("contributionCalendar", {}).get(
+        total = 0
+        for year_data in viewer.values():
+            if year_data is None:
+                continue
+            total += year_data.get("contributionCalendar", {}).get(
                 "totalContributions", 0
             )
-        return cast(int, self._total_contributions)
+        self._total_contributions = total
+        return total
 
     @property
     async def lines_changed(self) -> Tuple[int, int]:
@@ -432,30 +813,57 @@ Languages:
         additions = 0
         deletions = 0
         
-        repo_list = list(await self.repos)
-        tasks = [
-            self.queries.query_rest(f"/repos/{repo}/stats/contributors") 
-            for repo in repo_list
-        ]
-        
-        results = await asyncio.gather(*tasks)
+        await self.get_stats()
+        user_id = self._user_id
+        if user_id is None:
+            self._lines_changed = (0, 0)
+            return self._lines_changed
 
-        for response_obj in results:
-            if not isinstance(response_obj, list):
-                continue
-            
-            for author_obj in response_obj:
-                if not isinstance(author_obj, dict) or not isinstance(
-                    author_obj.get("author", {}), dict
-                ):
-                    continue
-                author = author_obj.get("author", {}).get("login", "")
-                if author != self.username:
-                    continue
+        # Fetch commit histories with one aliased GraphQL query per batch of
+        # repositories, re-querying only the histories with more pages
+        batch_size = Queries.history_batch_size
 
-                for week in author_obj.get("weeks", []):
-                    additions += week.get("a", 0)
-                    deletions += week.get("d", 0)
+        async def query_batch(batch: List[Tuple[str, Optional[str]]]) -> Dict:
+            # Line counts are approximate anyway, so a batch that keeps failing
+            # is left out rather than failing the whole run
+            try:
+                return await self._query_with_retry(
+                    Queries.lines_changed_batch(user_id, batch)
+                )
+            except GithubQueryError as e:
+                repos = ", ".join(repo for repo, _ in batch)
+                log.warning("%s. Lines changed for %s will be incomplete.", e, repos)
+                return dict()
+
+        pending: List[Tuple[str, Optional[str]]] = [
+            (repo, None) for repo in self.repos
+        ]
+        while pending:
+            batches = [
+                pending[i : i + batch_size] for i in range(0, len(pending), batch_size)
+            ]
+            results = await self._bounded_map(query_batch, batches)
+
+            pending = []
+            for batch, result in zip(batches, results):
+                data = result.get("data") or {}
+                for i, (repo, _) in enumerate(batch):
+                    branch = (data.get(f"repo{i}") or {}).get("defaultBranchRef") or {}
+                    history = (branch.get("target") or {}).get("history") or {}
+                    for commit in history.get("nodes") or []:
+                        # Commits whose diff stats are unavailable come back null
+                        if commit is None:
+                            continue
+                        # Merge commits repeat the merged branch's changes, so
+                        # skip them like GitHub's contributor statistics do
+                        if (commit.get("parents") or {}).get("totalCount", 0) > 1:
+                            continue
+                        additions += commit.get("additions", 0)
+                        deletions += commit.get("deletions", 0)
+
+                    page_info = history.get("pageInfo", {})
+                    if page_info.get("hasNextPage", False):
+                        pending.append((repo, page_info.get("endCursor")))
 
         self._lines_changed = (additions, deletions)
         return self._lines_changed
@@ -467,19 +875,31 @@ Languages:
 
         total = 0
         
-        repo_list = list(await self.repos)
-        tasks = [
-            self.queries.query_rest(f"/repos/{repo}/traffic/views") 
-            for repo in repo_list
-        ]
-        
-        results = await asyncio.gather(*tasks)
+        await self.get_stats()
+        repo_list = list(self.repos)
 
-        for result in results:
+        def count_views(result: Any) -> int:
             if not isinstance(result, dict):
-                continue
-            for view in result.get("views", []):
-                total += view.get("count", 0)
+                return 0
+            return sum(view.get("count", 0) for view in result.get("views", []))
+
+        async def repo_views(repo: str) -> Any:
+            # View counts are approximate anyway, so a repository that keeps
+            # failing is left out rather than failing the whole run
+            try:
+                return await self.queries.query_rest(
+                    f"/repos/{repo}/traffic/views", summarize=count_views
+                )
+            except GithubQueryError as e:
+                log.warning("%s. Views for %s will be incomplete.", e, repo)
+                return 0
+
+        results = await self._bounded_map(repo_views, repo_list)
+
+        for result in results:
+            # Skipped client errors return an empty dict rather than a count
+            if isinstance(result, int):
+                total += result
 
         self._views = total
         return total